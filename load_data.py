@@ -1,8 +1,23 @@
 import pandas as pd
-from models import SessionLocal, Crime, engine # Import from models.py
+from models import SessionLocal, Crime, DATABASE_URL # Import from models.py
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 import os
+import struct
 import importlib
+from io import StringIO
+
+# Dedicated ingest engine: psycopg2's values_plus_batch executemany mode
+# consolidates the fallback ORM inserts into multi-row VALUES statements at
+# the wire level (one parse/plan for thousands of rows instead of row-by-row).
+# SQLAlchemy 2.0 sizes the VALUES pages via the engine-wide
+# insertmanyvalues_page_size (the old executemany_values_page_size is gone).
+engine = create_engine(
+    DATABASE_URL,
+    executemany_mode='values_plus_batch',
+    insertmanyvalues_page_size=10000,
+    executemany_batch_page_size=500,
+)
 
 # --- 1. CONFIGURATION ---
 CSV_FILE_PATH = "ALL_INDIA_DATA.csv" 
@@ -22,23 +37,70 @@ print(f"Total rows to insert after cleaning: {len(df)}")
 
 # --- !!! THIS IS THE FIX !!! ---
 # Convert NumPy types (np.int64) to standard Python types (int, float)
+# Single astype call: one fused pass over the frame instead of six, and
+# narrow integer types (hour fits in int8, year in int16) halve the bytes
+# moved during the later serialization step. String columns are fine as-is.
 print("Converting data types...")
-df['year'] = df['year'].astype(int)
-df['count'] = df['count'].astype(float)
-df['hour_of_day'] = df['hour_of_day'].astype(int)
-df['minute'] = df['minute'].astype(int)
-df['latitude'] = df['latitude'].astype(float)
-df['longitude'] = df['longitude'].astype(float)
-# String columns are fine as-is
+df = df.astype({
+    'year': 'int16',
+    'count': 'float64',
+    'hour_of_day': 'int8',
+    'minute': 'int8',
+    'latitude': 'float64',
+    'longitude': 'float64',
+})
 # --- !!! END OF FIX !!! ---
 
-print("Converting data to dictionary...")
-data_dict = df.to_dict(orient='records')
+def ewkb_hex_point(lon, lat):
+    """Hex-encoded little-endian EWKB for a SRID=4326 POINT.
+
+    PostGIS ingests hex EWKB directly, so the server skips the WKT
+    text-parsing step entirely. 0x20000001 = Point with embedded SRID.
+    """
+    return struct.pack('<BIIdd', 1, 0x20000001, 4326, lon, lat).hex()
+
+
+print("Preparing PostGIS geometry (EWKB)...")
+# SRID=4326 must match your models.py
+df['location'] = [
+    ewkb_hex_point(lon, lat)
+    for lon, lat in zip(df['longitude'].values, df['latitude'].values)
+]
+
+# Columns to send to the database (street_name may be absent in some CSVs)
+INSERT_COLUMNS = [
+    col for col in [
+        'state', 'district', 'year', 'crime_type', 'count',
+        'days', 'hour_of_day', 'minute', 'latitude', 'longitude',
+        'street_name', 'location'
+    ]
+    if col in df.columns
+]
+
+
+def copy_crimes(df):
+    """Fastest ingest path: stream the DataFrame through PostgreSQL COPY.
 
-print("Preparing PostGIS geometry...")
-for row in data_dict:
-    # SRID=4326 must match your models.py
-    row['location'] = f'SRID=4326;POINT({row["longitude"]} {row["latitude"]})'
+    COPY bypasses the ORM and per-row INSERT parsing entirely; the
+    geometry column goes over the wire as hex EWKB.
+    """
+    buf = StringIO()
+    df[INSERT_COLUMNS].to_csv(buf, index=False, header=False)
+    buf.seek(0)
+
+    raw_conn = engine.raw_connection()
+    try:
+        with raw_conn.cursor() as cursor:
+            # One-shot loader: skipping the WAL flush wait is safe here since
+            # a failed load is simply re-run
+            cursor.execute("SET synchronous_commit = off")
+            cursor.copy_expert(
+                f"COPY public.crimes ({', '.join(INSERT_COLUMNS)}) FROM STDIN WITH (FORMAT CSV)",
+                buf
+            )
+        raw_conn.commit()
+    finally:
+        raw_conn.close()
 
 # --- 4. CONNECT AND BULK INSERT ---
 Session = sessionmaker(bind=engine)
@@ -47,17 +109,61 @@ session = Session()
 print("Starting bulk insert. This may take a minute...")
 
 try:
-    # Drop and recreate the crimes table
+    # Drop and recreate the crimes table. The hotspot MV depends on crimes,
+    # so PostgreSQL refuses the DROP TABLE while it exists — drop the view
+    # first; it's rebuilt (freshly populated) after the load below.
     models = importlib.import_module('models')
+    models.drop_hotspot_view()
     models.Base.metadata.drop_all(bind=models.engine, tables=[models.Crime.__table__])
     models.Base.metadata.create_all(bind=models.engine, tables=[models.Crime.__table__])
     print('Dropped and recreated crimes table')
-    
-    session.bulk_insert_mappings(Crime, data_dict)
+
+    # Load without the spatial index: maintaining the GiST tree costs
+    # O(log N) per inserted row, while building it once over the loaded
+    # table is far cheaper and produces a better-packed index. create_all
+    # just built the covering index, so drop it (and the legacy auto index,
+    # if an old database still has one) for the duration of the load.
+    session.execute(text('DROP INDEX IF EXISTS public.idx_crimes_location'))
+    session.execute(text('DROP INDEX IF EXISTS public.ix_crimes_location_covering'))
     session.commit()
-    
+
+    try:
+        print("Using COPY FROM STDIN (fastest path)...")
+        copy_crimes(df)
+    except Exception as copy_error:
+        print(f"COPY failed ({copy_error}), falling back to ORM bulk insert...")
+        # Insert in ~10,000-row batches: PostgreSQL throughput peaks around this
+        # batch size, and one giant insert balloons memory on both ends
+        session.execute(text("SET synchronous_commit = off"))
+        # geoalchemy2 wraps string binds in ST_GeomFromEWKT, which parses
+        # EWKT text — the hex EWKB built for COPY would fail here, so the
+        # fallback rows carry EWKT geometry instead
+        fallback_df = df[INSERT_COLUMNS].copy()
+        fallback_df['location'] = [
+            f'SRID=4326;POINT({lon} {lat})'
+            for lon, lat in zip(df['longitude'].values, df['latitude'].values)
+        ]
+        data_dict = fallback_df.to_dict(orient='records')
+        BATCH_SIZE = 10000
+        for i in range(0, len(data_dict), BATCH_SIZE):
+            session.bulk_insert_mappings(Crime, data_dict[i:i + BATCH_SIZE])
+            print(f"  Inserted rows {i} to {min(i + BATCH_SIZE, len(data_dict))}...")
+        session.commit()
+
+    print("Rebuilding spatial index...")
+    session.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_crimes_location_covering '
+        'ON public.crimes USING gist (location) '
+        'INCLUDE (latitude, longitude, crime_type)'
+    ))
+    session.commit()
+
+    # Recreate the hotspot clusters from the freshly loaded data (the
+    # CREATE populates the view, so no separate refresh is needed)
+    models.ensure_hotspot_view()
+
     print("\n--- SUCCESS! ---")
-    print(f"All {len(data_dict)} rows have been loaded into the database.")
+    print(f"All {len(df)} rows have been loaded into the database.")
 
 except Exception as e:
     print(f"\n--- ERROR ---")
@@ -1,9 +1,16 @@
 import os
 import json
+import time
+import asyncio
+import threading
 import joblib
 import h3
-import requests
+import httpx
+import numpy as np
+from collections import Counter, namedtuple
 from datetime import datetime, timedelta
+from functools import lru_cache
+from math import cos, radians
 from typing import List
 from dotenv import load_dotenv
 
@@ -13,12 +20,17 @@ load_dotenv()
 # FastAPI and dependencies
 from fastapi import FastAPI, HTTPException, Depends, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import func, text
+from geoalchemy2 import Geography
 from geoalchemy2.functions import ST_MakePoint, ST_DWithin, ST_SetSRID, ST_AsGeoJSON
 from pydantic import BaseModel
 # Import database models
-from models import SessionLocal, Crime, NewsArticle, engine, Base
+from models import (
+    SessionLocal, Crime, NewsArticle, engine, Base,
+    ensure_hotspot_view, refresh_hotspot_view,
+)
 
 # --- CONFIGURATION ---
 
@@ -31,6 +43,29 @@ ALLOWED_ORIGINS = [
 # H3 resolution used for prediction cells (e.g., 8 is ~0.73 sq km)
 H3_RESOLUTION = 8 
 
+# Weekday names indexed by datetime.weekday(); avoids strftime('%A') locale
+# lookups on the hot path (must match the names the day encoder was fit on)
+DAY_NAMES = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+
+# Shared time cell: day name / hour / weekday change at most once a minute,
+# so they're derived once per minute instead of per request. Lock-free — the
+# tuple is rebuilt locally and published with one name rebind (atomic in
+# CPython); a racing request at a minute boundary just recomputes the same
+# values.
+_TIME_CELL = (-1, None, '', 0, 0)  # (minute_epoch, now, day_name, hour, weekday)
+
+def time_parts():
+    """Returns (now, day_name, hour, weekday), refreshed lazily per minute."""
+    global _TIME_CELL
+    minute_epoch = int(time.time() // 60)
+    cell = _TIME_CELL
+    if cell[0] != minute_epoch:
+        now = datetime.now()
+        weekday = now.weekday()
+        cell = (minute_epoch, now, DAY_NAMES[weekday], now.hour, weekday)
+        _TIME_CELL = cell
+    return cell[1], cell[2], cell[3], cell[4]
+
 # Three-Layer Prediction Weights
 WEIGHT_HISTORICAL = 0.2   # Past patterns (2001-2014 data)
 WEIGHT_ENVIRONMENTAL = 0.5  # Present-day POI density
@@ -38,33 +73,196 @@ WEIGHT_CONTEXTUAL = 0.3     # Recent news (48 hours)
 
 # --- MODEL AND SCHEDULER (Placeholder for actual execution) ---
 
-# Mock Model/Encoder storage (actual .joblib files would be loaded here)
-crime_model = None
-h3_index_encoder = None
-day_encoder = None
+# All inference state travels together in one immutable bundle:
+#   model            — XGBoost classifier
+#   h3_lookup        — dict of h3 index -> encoded int (O(1) vs LabelEncoder's
+#                      per-call searchsorted + ValueError handling)
+#   day_code_by_weekday — encoded day indexed by datetime.weekday(), so the
+#                      hot path never touches the day-name string
+#   risk_table       — optional precomputed (h3, day, hour) -> risk class
+#                      array from train_model.py; turns predict into an index
+#   onnx_session / onnx_input_name — optional onnxruntime fast path
+# load_models() builds a complete bundle and publishes it with a single name
+# rebind (atomic in CPython), so a request during a retrain can never observe
+# a new model paired with old encoders.
+ModelBundle = namedtuple(
+    'ModelBundle',
+    ['model', 'h3_lookup', 'day_code_by_weekday', 'risk_table',
+     'onnx_session', 'onnx_input_name']
+)
+BUNDLE = None
+
+# Micro-batching queue for single-point inference: concurrent /predict_risk
+# requests are coalesced by a background task into one batched predict call,
+# amortizing the model's fixed per-call overhead (started on app startup).
+_BATCH_QUEUE: asyncio.Queue = None
+_BATCH_TASK = None
+_BATCH_MAX_SIZE = 64
+_BATCH_MAX_WAIT = 0.005  # seconds to wait for more requests to coalesce
 
 class LocationInput(BaseModel):
     latitude: float
     longitude: float
+
+class RouteInput(BaseModel):
+    points: List[LocationInput]
 def load_models():
-    """Loads ML models and encoders on startup."""
-    global crime_model, h3_index_encoder, day_encoder
+    """Loads ML models and encoders, then atomically publishes the bundle."""
+    global BUNDLE
     try:
         print("Loading XGBoost ML models from disk...")
-        crime_model = joblib.load('crime_model.joblib')
-        h3_index_encoder = joblib.load('h3_index_encoder.joblib')
-        day_encoder = joblib.load('day_encoder.joblib')
+        # Prefer XGBoost's native JSON format: much faster to parse than the
+        # pickled wrapper, and produced alongside the .joblib by train_model.py
+        if os.path.exists('crime_model.json'):
+            import xgboost as xgb
+            crime_model = xgb.XGBClassifier()
+            crime_model.load_model('crime_model.json')
+        else:
+            crime_model = joblib.load('crime_model.joblib')
+        # mmap_mode='r' memory-maps the encoders' numpy arrays so uvicorn
+        # workers share read-only pages via the OS cache instead of each
+        # deserializing a private copy
+        h3_index_encoder = joblib.load('h3_index_encoder.joblib', mmap_mode='r')
+        day_encoder = joblib.load('day_encoder.joblib', mmap_mode='r')
+        h3_lookup = {cls: i for i, cls in enumerate(h3_index_encoder.classes_)}
+        day_lookup = {cls: i for i, cls in enumerate(day_encoder.classes_)}
+        day_code_by_weekday = tuple(day_lookup.get(name, 0) for name in DAY_NAMES)
         print("✅ XGBoost model and encoders loaded successfully!")
-        
+
+        # Precomputed risk table from train_model.py: all three features are
+        # bounded integers, so serving becomes one mmap'd array index
+        risk_table = None
+        if os.path.exists('risk_table.npy'):
+            risk_table = np.load('risk_table.npy', mmap_mode='r')
+            print("✅ Precomputed risk table loaded — O(1) historical predictions")
+
+        # Prefer the ONNX graph when available: onnxruntime's C++ executor
+        # has near-zero per-call overhead versus the Python->Booster->DMatrix
+        # path, which dominates single-row inference latency
+        onnx_session = None
+        onnx_input_name = None
+        try:
+            import onnxruntime as ort
+            if os.path.exists('crime_model.onnx'):
+                onnx_session = ort.InferenceSession(
+                    'crime_model.onnx', providers=['CPUExecutionProvider']
+                )
+                onnx_input_name = onnx_session.get_inputs()[0].name
+                print("✅ ONNX model loaded — using onnxruntime for inference")
+        except ImportError:
+            pass  # onnxruntime is optional; XGBoost path works without it
+
+        # Single-pointer publish: in-flight requests keep the old bundle,
+        # new requests see the complete new one
+        BUNDLE = ModelBundle(
+            model=crime_model,
+            h3_lookup=h3_lookup,
+            day_code_by_weekday=day_code_by_weekday,
+            risk_table=risk_table,
+            onnx_session=onnx_session,
+            onnx_input_name=onnx_input_name,
+        )
+
     except Exception as e:
         print(f"ERROR: Could not load ML models: {e}")
         print("Make sure you've run train_model.py to generate the .joblib files.")
         # In a real deployment, you might let the app crash if models fail to load
 
+def predict_historical(features, bundle=None):
+    """Runs the historical model on an (N, 3) float32 feature array.
+
+    Prefers the precomputed risk table (pure array indexing), then the
+    onnxruntime session, then the XGBoost wrapper. All return an array of
+    N risk classes (0=Low, 1=Medium, 2=High). Callers that encoded the
+    features themselves must pass the bundle they encoded against, so a
+    load_models() in between can't pair old encodings with a new model.
+    """
+    if bundle is None:
+        bundle = BUNDLE
+    if bundle.risk_table is not None:
+        idx = features.astype(np.int64)
+        return bundle.risk_table[idx[:, 0], idx[:, 1], idx[:, 2]]
+    if bundle.onnx_session is not None:
+        return bundle.onnx_session.run(None, {bundle.onnx_input_name: features})[0]
+    return bundle.model.predict(features)
+
+
+async def _inference_batcher():
+    """Background task: drains queued feature rows into batched predictions.
+
+    Waits up to _BATCH_MAX_WAIT after the first queued request for more to
+    arrive (capped at _BATCH_MAX_SIZE), encodes the H3 cells against the
+    current bundle in one pass, runs one predict over the stacked rows, then
+    resolves each request's future by position.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await _BATCH_QUEUE.get()]
+        deadline = loop.time() + _BATCH_MAX_WAIT
+        while len(batch) < _BATCH_MAX_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(_BATCH_QUEUE.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        # Encode per flush, not per request: one dict-lookup comprehension
+        # over the whole batch. The bundle is captured once so the encoding
+        # and the predict below can't straddle a load_models() swap.
+        bundle = BUNDLE
+        features = np.array(
+            [(bundle.h3_lookup.get(cell, 0), day, hour) for (cell, day, hour), _ in batch],
+            dtype=np.float32,
+        )
+        try:
+            predictions = predict_historical(features, bundle)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            continue
+
+        for (_, future), prediction in zip(batch, predictions):
+            if not future.done():
+                future.set_result(int(prediction))
+
+
+async def predict_historical_queued(h3_index: str, day_encoded: int, hour: int) -> int:
+    """Single-row historical prediction routed through the micro-batcher.
+
+    Takes the raw H3 cell; the batcher encodes it during the flush.
+    """
+    future = asyncio.get_running_loop().create_future()
+    await _BATCH_QUEUE.put(((h3_index, day_encoded, hour), future))
+    return await future
+
+
+# Serializes retrains: training is CPU/memory heavy and must never run twice
+# concurrently in one process
+TRAIN_LOCK = threading.Lock()
+
+
+def run_training():
+    """Retrains the model in-process and hot-reloads the artifacts.
+
+    Calling train_and_persist() directly skips the interpreter startup and
+    pandas/sklearn import cost a subprocess retrainer would pay on every run.
+    """
+    from train_model import train_and_persist
+
+    with TRAIN_LOCK:
+        if train_and_persist():
+            load_models()
+            refresh_hotspot_view()
+
+
 def start_scheduler():
     """Placeholder for APScheduler setup (Task 2 logic is now in GitHub Actions)."""
     print("APScheduler logic is intentionally skipped in this local main.py.")
     print("Daily model retraining is handled via GitHub Actions (Task 2).")
+    print("In-process retraining is available via run_training() if needed.")
 
 def get_db():
     db = SessionLocal()
@@ -74,9 +272,29 @@ def get_db():
         db.close()
 
 
+@lru_cache(maxsize=50000)
+def cell_and_boundary(lat_rounded: float, lon_rounded: float):
+    """H3 cell index and boundary for coordinates rounded to 4 decimals.
+
+    ~11m of rounding can never cross more than one cell edge at resolution 8,
+    and neighboring requests overwhelmingly land on identical rounded
+    coordinates, so the cache avoids recomputing (and re-allocating) the
+    boundary tuple per request.
+    """
+    cell = h3.latlng_to_cell(lat_rounded, lon_rounded, H3_RESOLUTION)
+    return cell, h3.cell_to_boundary(cell)
+
+
 # --- LAYER 2: ENVIRONMENTAL SCORING (OpenStreetMap POI Analysis) ---
 
-def get_environmental_risk_score(lat: float, lon: float, radius_meters: int = 500):
+# Shared keep-alive HTTP client for outbound API calls (created on startup).
+# Using one AsyncClient reuses connections and, crucially, awaiting it frees
+# the event loop during the slow Overpass round-trip instead of pinning a
+# uvicorn worker like blocking requests.post() did.
+http_client: httpx.AsyncClient = None
+
+
+async def get_environmental_risk_score(lat: float, lon: float, radius_meters: int = 500):
     """
     Layer 2: Queries OpenStreetMap Overpass API for crime-correlated POIs.
     
@@ -92,7 +310,9 @@ def get_environmental_risk_score(lat: float, lon: float, radius_meters: int = 50
         radius_meters: Search radius (default 500m)
     
     Returns:
-        tuple: (risk_score: int [0-2], poi_count: int, poi_details: dict)
+        tuple: (risk_score: int [0-2], poi_count: int, poi_details: dict),
+        or None when the Overpass call fails (callers substitute a neutral
+        fallback — returning it from here would let failures be cached)
     """
     overpass_url = "https://overpass-api.de/api/interpreter"
     
@@ -111,38 +331,26 @@ def get_environmental_risk_score(lat: float, lon: float, radius_meters: int = 50
     """
     
     try:
-        response = requests.post(overpass_url, data={'data': overpass_query}, timeout=12)
+        response = await http_client.post(overpass_url, data={'data': overpass_query})
         response.raise_for_status()
         data = response.json()
         
         elements = data.get('elements', [])
         poi_count = len(elements)
         
-        # Categorize POIs
+        # Categorize POIs: Counter tallies in C, and missing keys read as 0,
+        # so no per-element Python branching is needed
+        amenity_counts = Counter(e.get('tags', {}).get('amenity') for e in elements)
+        shop_counts = Counter(e.get('tags', {}).get('shop') for e in elements)
+
         poi_breakdown = {
-            'bars': 0,
-            'nightclubs': 0,
-            'atms': 0,
-            'banks': 0,
-            'alcohol_shops': 0
+            'bars': amenity_counts['bar'] + amenity_counts['pub'],
+            'nightclubs': amenity_counts['nightclub'],
+            'atms': amenity_counts['atm'],
+            'banks': amenity_counts['bank'],
+            'alcohol_shops': shop_counts['alcohol']
         }
         
-        for element in elements:
-            tags = element.get('tags', {})
-            amenity = tags.get('amenity', '')
-            shop = tags.get('shop', '')
-            
-            if amenity == 'bar' or amenity == 'pub':
-                poi_breakdown['bars'] += 1
-            elif amenity == 'nightclub':
-                poi_breakdown['nightclubs'] += 1
-            elif amenity == 'atm':
-                poi_breakdown['atms'] += 1
-            elif amenity == 'bank':
-                poi_breakdown['banks'] += 1
-            elif shop == 'alcohol':
-                poi_breakdown['alcohol_shops'] += 1
-        
         # Risk scoring based on POI density
         if poi_count >= 10:
             risk_score = 2  # High Risk: Dense commercial/nightlife area
@@ -153,20 +361,82 @@ def get_environmental_risk_score(lat: float, lon: float, radius_meters: int = 50
         
         return risk_score, poi_count, poi_breakdown
         
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         print(f"Overpass API error: {e}")
-        # Fallback to neutral score if API fails
-        return 1, 0, {}
+        return None
     except Exception as e:
         print(f"Environmental scoring error: {e}")
+        return None
+
+
+# Manual cache for the async Overpass lookup (lru_cache can't wrap coroutines)
+_ENV_CACHE = {}
+_ENV_CACHE_TTL = 3600  # seconds — POI density changes slowly
+_ENV_CACHE_MAXSIZE = 10000
+
+# Full-response TTL cache for /predict_risk. Everyone inside the same H3
+# cell during the same hour gets an identical three-layer computation, so a
+# short TTL safely elides the Overpass call, the news query and the model.
+_RISK_CACHE = {}
+_RISK_CACHE_TTL = 600  # seconds
+_RISK_CACHE_MAXSIZE = 100000
+
+
+async def get_environmental_risk_cached(lat_rounded: float, lon_rounded: float, radius_meters: int = 500):
+    """Cached wrapper for the Overpass lookup.
+
+    Keyed on coordinates rounded to 3 decimals (~100m grid): POI density
+    barely changes within that distance, so repeated route/neighborhood
+    queries skip the slow external API call entirely. Entries expire after
+    an hour, and Overpass failures are never cached — a transient timeout
+    must not pin a grid cell to the neutral fallback until restart.
+    """
+    key = (lat_rounded, lon_rounded, radius_meters)
+    cached = _ENV_CACHE.get(key)
+    if cached is not None:
+        expiry, result = cached
+        if time.monotonic() < expiry:
+            return result
+        del _ENV_CACHE[key]
+
+    result = await get_environmental_risk_score(lat_rounded, lon_rounded, radius_meters)
+    if result is None:
+        # Neutral fallback, uncached so the next request retries Overpass
         return 1, 0, {}
+    if len(_ENV_CACHE) >= _ENV_CACHE_MAXSIZE:
+        _ENV_CACHE.clear()
+    _ENV_CACHE[key] = (time.monotonic() + _ENV_CACHE_TTL, result)
+    return result
+
+
+# --- LAYER 3: CONTEXTUAL SCORING (Recent News) ---
+
+def query_recent_news(db: Session, lat: float, lon: float, time_window, radius_meters: int = 1500):
+    """Layer 3 DB lookup: recent geolocated crime news near the point.
+
+    Kept synchronous (SQLAlchemy Session) and dispatched via
+    asyncio.to_thread so it can overlap with the Overpass call.
+    """
+    return db.query(NewsArticle).filter(
+        (NewsArticle.published_at >= time_window) &
+        (
+            # Geography cast so the radius is interpreted in meters, not degrees
+            ST_DWithin(
+                NewsArticle.location.cast(Geography),
+                ST_SetSRID(ST_MakePoint(lon, lat), 4326).cast(Geography),
+                radius_meters
+            )
+        )
+    ).limit(10).all()
 
 
 # --- DATABASE DEPENDENCY ---
 
 # --- FASTAPI APP INITIALIZATION ---
 
-app = FastAPI(title="Geospatial Crime Predictor API")
+# orjson serializes the float-heavy prediction/hotspot payloads several times
+# faster than the stdlib json encoder
+app = FastAPI(title="Geospatial Crime Predictor API", default_response_class=ORJSONResponse)
 
 # Initialize CORS Middleware (Crucial fix from earlier!)
 app.add_middleware(
@@ -180,13 +450,55 @@ app.add_middleware(
 # Load models upon application startup
 @app.on_event("startup")
 async def startup_event():
+    global http_client, _BATCH_QUEUE, _BATCH_TASK
+    http_client = httpx.AsyncClient(timeout=12)
+    _BATCH_QUEUE = asyncio.Queue()
+    _BATCH_TASK = asyncio.create_task(_inference_batcher())
     # Ensure tables are created (optional, but harmless)
     Base.metadata.create_all(bind=engine)
+    ensure_hotspot_view()
     load_models()
     start_scheduler() # Just prints status now
 
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if _BATCH_TASK:
+        _BATCH_TASK.cancel()
+    if http_client:
+        await http_client.aclose()
+
 # --- API ENDPOINTS ---
 
+# Module-level parameterized statement for /get_hotspots: SQLAlchemy renders
+# it once (compiled cache) and PostgreSQL sees identical query text every
+# call, so parse/plan work is paid once instead of per request.
+HOTSPOT_STMT = text("""
+    SELECT latitude, longitude, crime_type
+    FROM public.crimes
+    WHERE location && ST_MakeEnvelope(:xmin, :ymin, :xmax, :ymax, 4326)
+      AND ST_DWithin(
+            location::geography,
+            ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)::geography,
+            :radius_meters
+          )
+    LIMIT 500
+""")
+
+# Precomputed hotspot clusters: the mv_hotspots materialized view defined in
+# models.py (shared with load_data.py, which rebuilds it around re-ingest).
+MV_HOTSPOT_STMT = text("""
+    SELECT latitude, longitude, crime_type, incident_count
+    FROM public.mv_hotspots
+    WHERE location && ST_MakeEnvelope(:xmin, :ymin, :xmax, :ymax, 4326)
+      AND ST_DWithin(
+            location::geography,
+            ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)::geography,
+            :radius_meters
+          )
+    LIMIT 500
+""")
+
 @app.get("/get_hotspots")
 async def get_hotspots(lat: float, lon: float, radius_km: float = 2.0, db: Session = Depends(get_db)):
     """
@@ -198,33 +510,56 @@ async def get_hotspots(lat: float, lon: float, radius_km: float = 2.0, db: Sessi
     # We use ST_MakePoint and ST_SetSRID to query for points near the user's location
     # The 'location' column in the Crime model is indexed for fast geospatial lookup
     
+    # Cheap bounding-box prefilter: the && box-overlap operator hits the GiST
+    # index almost for free and prunes the vast majority of rows before the
+    # expensive per-row ST_DWithin distance check runs.
+    delta_lat = radius_km / 111.0
+    delta_lon = radius_km / (111.0 * max(cos(radians(lat)), 0.01))
     # Note: We must specify public.crimes due to the search path issues we fixed earlier.
-    query = db.query(
-        Crime.latitude, Crime.longitude, Crime.crime_type, Crime.days, Crime.hour_of_day
-    ).filter(
-        ST_DWithin(
-            Crime.location, 
-            ST_SetSRID(ST_MakePoint(lon, lat), 4326), # Input Point (lon, lat)
-            radius_meters # Radius in meters
-        )
-    ).limit(500) # Limit to 500 hotspots as per Fragment 4 plan
+    # Geography cast keeps radius_meters in real meters; limit of 500
+    # hotspots as per Fragment 4 plan.
+    params = {
+        "xmin": lon - delta_lon,
+        "ymin": lat - delta_lat,
+        "xmax": lon + delta_lon,
+        "ymax": lat + delta_lat,
+        "lon": lon,
+        "lat": lat,
+        "radius_meters": radius_meters,
+    }
+
+    # Serve from the precomputed cluster view when it exists; fall back to
+    # the raw crimes table (e.g. before the MV has been created)
+    try:
+        clusters = db.execute(MV_HOTSPOT_STMT, params).all()
+        formatted_hotspots = [
+            {
+                "latitude": latitude,
+                "longitude": longitude,
+                "type": crime_type,
+                "count": incident_count,
+            }
+            for latitude, longitude, crime_type, incident_count in clusters
+            if latitude is not None and longitude is not None
+        ]
+        return {"hotspots": formatted_hotspots, "count": len(formatted_hotspots)}
+    except Exception as e:
+        db.rollback()
+        print(f"Warning: mv_hotspots unavailable ({e}), querying crimes directly.")
+
+    hotspots = db.execute(HOTSPOT_STMT, params).all()
 
-    hotspots = query.all()
-    
     if not hotspots:
         return {"hotspots": [], "count": 0}
 
-    # Format output for the frontend with correct field names
+    # Format output for the frontend with correct field names; rows unpack
+    # positionally, which skips the Row attribute-descriptor machinery
     formatted_hotspots = [
-        {
-            "latitude": h.latitude,    # Changed from "lat" to "latitude"
-            "longitude": h.longitude,  # Changed from "lon" to "longitude"
-            "type": h.crime_type
-        } 
-        for h in hotspots 
-        if h.latitude is not None and h.longitude is not None  # Filter out NULL values
+        {"latitude": latitude, "longitude": longitude, "type": crime_type}
+        for latitude, longitude, crime_type in hotspots
+        if latitude is not None and longitude is not None  # Filter out NULL values
     ]
-    
+
     return {"hotspots": formatted_hotspots, "count": len(formatted_hotspots)}
 
 
@@ -244,41 +579,40 @@ async def predict_risk(location_data: LocationInput, fast_mode: bool = False, db
     lat = location_data.latitude
     lon = location_data.longitude
     
-    if not crime_model:
+    if BUNDLE is None:
         raise HTTPException(status_code=503, detail="ML Model not loaded.")
+    # Grab the bundle once: a retrain swapping BUNDLE mid-request can't give
+    # us a new model paired with old encoder lookups
+    bundle = BUNDLE
 
     # --- LAYER 1: HISTORICAL SCORE (The Past) ---
-    current_time = datetime.now()
-    day_name = current_time.strftime('%A')
-    hour = current_time.hour
+    # Shared per-minute time cell: one tuple read instead of datetime
+    # formatting on every request
+    current_time, day_name, hour, weekday = time_parts()
     
-    h3_index = h3.latlng_to_cell(lat, lon, H3_RESOLUTION)
-    h3_boundary = h3.cell_to_boundary(h3_index)
+    h3_index, h3_boundary = cell_and_boundary(round(lat, 4), round(lon, 4))
+
+    # Cache hit: return the stored response with a refreshed timestamp
+    cache_key = (h3_index, day_name, hour, fast_mode)
+    cached = _RISK_CACHE.get(cache_key)
+    if cached is not None:
+        expiry, cached_response = cached
+        if time.monotonic() < expiry:
+            response = dict(cached_response)
+            response["current_time"] = current_time.isoformat()
+            return response
+        del _RISK_CACHE[cache_key]
 
     # REAL XGBoost Prediction
     try:
-        # Encode features using the same encoders from training
-        # Handle unseen H3 indices gracefully
-        try:
-            h3_encoded = h3_index_encoder.transform([h3_index])[0]
-        except ValueError:
-            # H3 index not seen during training - use a default/average encoding
-            print(f"Warning: H3 index {h3_index} not in training data. Using fallback.")
-            h3_encoded = 0  # Default to first encoding
-        
-        try:
-            day_encoded = day_encoder.transform([day_name])[0]
-        except ValueError:
-            # Day name issue (shouldn't happen but be safe)
-            print(f"Warning: Day {day_name} not in training data. Using fallback.")
-            day_encoded = 0
-        
-        # Create feature vector: [h3_index_encoded, day_encoded, hour_of_day]
-        features = [[h3_encoded, day_encoded, hour]]
-        
-        # Get prediction from XGBoost model (0=Low, 1=Medium, 2=High)
-        historical_prediction = crime_model.predict(features)[0]
-        historical_score = int(historical_prediction)
+        # Encode features using the lookups prebuilt from the training
+        # encoders; unseen H3 indices fall back to the first encoding
+        day_encoded = bundle.day_code_by_weekday[weekday]
+
+        # Feature vector [h3_index_encoded, day_encoded, hour_of_day] goes
+        # through the micro-batcher, which encodes the H3 cell per flush;
+        # concurrent requests share one predict call (0=Low, 1=Medium, 2=High)
+        historical_score = await predict_historical_queued(h3_index, day_encoded, hour)
         
         print(f"Layer 1 (Historical - XGBoost): {historical_score}/2 for h3={h3_index[:10]}..., day={day_name}, hour={hour}")
     except Exception as e:
@@ -288,59 +622,46 @@ async def predict_risk(location_data: LocationInput, fast_mode: bool = False, db
     
     print(f"Layer 1 (Historical): {historical_score}/2")
 
-    # --- LAYER 2: ENVIRONMENTAL SCORE (The Present-Day World) ---
-    # Skip POI lookup in fast mode (expensive API call)
+    # --- LAYERS 2 + 3: ENVIRONMENTAL AND CONTEXTUAL SCORES ---
+    # Both are pure I/O with no data dependency, so outside fast mode they
+    # run concurrently: the Overpass HTTP call on the event loop, the
+    # PostGIS news query in a worker thread. Wall time is max() not sum().
     if fast_mode:
+        # Skip expensive POI/news lookups for route analysis
         environmental_score = 1  # Default to medium
         poi_count = 0
         poi_breakdown = {"bars": 0, "nightclubs": 0, "atms": 0, "banks": 0, "alcohol_shops": 0}
-    else:
-        environmental_score, poi_count, poi_breakdown = get_environmental_risk_score(lat, lon, radius_meters=500)
-    
-    print(f"Layer 2 (Environmental): {environmental_score}/2 (POIs: {poi_count})")
-    
-    # --- LAYER 3: CONTEXTUAL SCORE (The Immediate-Term) ---
-    # Skip news lookup in fast mode (expensive DB query)
-    if fast_mode:
         contextual_score = 1  # Default to medium
         news_count = 0
         news_articles = []
     else:
-        context_radius_meters = 1500 
-        time_window = datetime.now() - timedelta(hours=24)
-        
-        context_query = db.query(NewsArticle).filter(
-            (NewsArticle.published_at >= time_window) & 
-            (
-                ST_DWithin(
-                    NewsArticle.location,
-                    ST_SetSRID(ST_MakePoint(lon, lat), 4326),
-                    context_radius_meters
-                )
-            )
-        ).limit(10)
-        
-        recent_context = context_query.all()
-        context_count = len(recent_context)
-        
+        time_window = current_time - timedelta(hours=24)
+
+        (environmental_score, poi_count, poi_breakdown), recent_context = await asyncio.gather(
+            get_environmental_risk_cached(round(lat, 3), round(lon, 3), 500),
+            asyncio.to_thread(query_recent_news, db, lat, lon, time_window)
+        )
+
+        news_count = len(recent_context)
+
         # Contextual risk scoring
-        if context_count >= 3:
+        if news_count >= 3:
             contextual_score = 2  # High: Multiple recent incidents
-        elif context_count >= 1:
+        elif news_count >= 1:
             contextual_score = 1  # Medium: Some recent activity
         else:
             contextual_score = 0  # Low: No recent news
-        
-        news_count = context_count
+
         news_articles = [
             {
                 'title': article.title,
                 'published_at': article.published_at.isoformat() if article.published_at else None,
                 'url': article.url
-            } 
+            }
             for article in recent_context
         ]
-    
+
+    print(f"Layer 2 (Environmental): {environmental_score}/2 (POIs: {poi_count})")
     print(f"Layer 3 (Contextual): {contextual_score}/2 (News: {news_count})")
     
     # --- WEIGHTED COMBINATION ---
@@ -373,15 +694,15 @@ async def predict_risk(location_data: LocationInput, fast_mode: bool = False, db
     else:
         explanation_parts.append("Quiet residential area")
     
-    if contextual_score >= 1:
-        explanation_parts.append(f"{context_count} crime report(s) in past 48 hours")
+    if contextual_score >= 1 and news_count:
+        explanation_parts.append(f"{news_count} crime report(s) in past 48 hours")
     
     if historical_score == 2:
         explanation_parts.append("Historically high-risk location")
     
     explanation = " + ".join(explanation_parts) if explanation_parts else "Standard risk assessment"
 
-    return {
+    response = {
         "risk_level": risk_level,
         "risk_code": final_risk_code,
         "risk_score_raw": round(final_score_raw, 2),
@@ -405,7 +726,7 @@ async def predict_risk(location_data: LocationInput, fast_mode: bool = False, db
                 "score": contextual_score,
                 "weight": WEIGHT_CONTEXTUAL,
                 "contribution": round(contextual_score * WEIGHT_CONTEXTUAL, 2),
-                "news_count": context_count,
+                "news_count": news_count,
                 "news_articles": context_data
             }
         },
@@ -416,6 +737,69 @@ async def predict_risk(location_data: LocationInput, fast_mode: bool = False, db
         "current_time": current_time.isoformat(),
     }
 
+    if len(_RISK_CACHE) >= _RISK_CACHE_MAXSIZE:
+        _RISK_CACHE.clear()
+    _RISK_CACHE[cache_key] = (time.monotonic() + _RISK_CACHE_TTL, response)
+
+    return response
+
+
+@app.post("/predict_route")
+async def predict_route(route_data: RouteInput):
+    """
+    Batched historical risk for a whole route in ONE XGBoost call.
+
+    Equivalent to calling /predict_risk with fast_mode=true once per sampled
+    point, but encodes every point up front and runs a single batched
+    model.predict, amortizing the per-call XGBoost overhead (which dominates
+    at single-row inference) across the route.
+    """
+    if BUNDLE is None:
+        raise HTTPException(status_code=503, detail="ML Model not loaded.")
+    if not route_data.points:
+        return {"points": [], "count": 0}
+    bundle = BUNDLE
+
+    current_time, _, hour, weekday = time_parts()
+    day_encoded = bundle.day_code_by_weekday[weekday]
+
+    features = []
+    h3_cells = []
+    for point in route_data.points:
+        h3_index = h3.latlng_to_cell(point.latitude, point.longitude, H3_RESOLUTION)
+        h3_cells.append(h3_index)
+        features.append([bundle.h3_lookup.get(h3_index, 0), day_encoded, hour])
+
+    # Single batched prediction for every sampled point on the route
+    try:
+        historical_scores = predict_historical(
+            np.asarray(features, dtype=np.float32), bundle
+        )
+    except Exception as e:
+        print(f"Warning: batched XGBoost prediction failed: {e}. Using fallback.")
+        historical_scores = [1] * len(features)
+
+    results = []
+    for point, h3_index, historical_score in zip(route_data.points, h3_cells, historical_scores):
+        # Same weighting as fast_mode /predict_risk: environmental and
+        # contextual layers default to medium (1)
+        final_score_raw = (
+            (int(historical_score) * WEIGHT_HISTORICAL) +
+            (1 * WEIGHT_ENVIRONMENTAL) +
+            (1 * WEIGHT_CONTEXTUAL)
+        )
+        final_risk_code = max(0, min(2, round(final_score_raw)))
+        results.append({
+            "latitude": point.latitude,
+            "longitude": point.longitude,
+            "h3_index": h3_index,
+            "risk_level": {0: "green", 1: "yellow", 2: "red"}.get(final_risk_code, "yellow"),
+            "risk_code": final_risk_code,
+            "risk_score_raw": round(final_score_raw, 2),
+        })
+
+    return {"points": results, "count": len(results), "current_time": current_time.isoformat()}
+
 
 @app.post("/add_crime")
 async def add_crime(secret_key: str, # Security check via environment variable
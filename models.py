@@ -1,6 +1,6 @@
 import os
 import sqlalchemy
-from sqlalchemy import create_engine, Column, Integer, String, Float
+from sqlalchemy import create_engine, Column, Integer, String, Float, Index, text
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from geoalchemy2 import Geometry
@@ -15,14 +15,34 @@ DATABASE_URL = os.getenv('DATABASE_URL')
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL not found in .env file. Please configure your environment variables.")
 
-engine = create_engine(DATABASE_URL)
+# Pool tuned for a serverless Postgres (Neon) that aggressively closes idle
+# connections: pre-ping revalidates a connection before handing it out
+# (instead of failing the request), recycle retires connections before the
+# server does, and the larger pool stops requests queuing on 5 connections.
+engine = create_engine(
+    DATABASE_URL,
+    pool_size=10,
+    max_overflow=20,
+    pool_pre_ping=True,
+    pool_recycle=300,
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base() 
 
 # --- 2. Define the Crime Table ---
 class Crime(Base):
     __tablename__ = "crimes"
-    __table_args__ = {"schema": "public"}
+    __table_args__ = (
+        # Covering GiST index for /get_hotspots: the bbox/ST_DWithin filter
+        # is answered by the spatial tree and the INCLUDEd payload columns
+        # (PG 12+) make it an index-only scan with no heap fetches
+        Index(
+            'ix_crimes_location_covering', 'location',
+            postgresql_using='gist',
+            postgresql_include=['latitude', 'longitude', 'crime_type'],
+        ),
+        {"schema": "public"},
+    )
     id = Column(Integer, primary_key=True, index=True)
     
     # From your CSV
@@ -42,10 +62,13 @@ class Crime(Base):
     longitude = Column(Float)
     
     # NEW: Added street_name column
-    street_name = Column(String, nullable=True) 
-    
-    # The special PostGIS column
-    location = Column(Geometry(geometry_type='POINT', srid=4326), index=True)
+    street_name = Column(String, nullable=True)
+
+    # The special PostGIS column. spatial_index=False: the covering GiST
+    # index in __table_args__ is the one spatial index on this column —
+    # letting geoalchemy2 auto-create idx_crimes_location as well would
+    # double the index-maintenance cost of every insert
+    location = Column(Geometry(geometry_type='POINT', srid=4326, spatial_index=False))
 
 
 # --- 2b. Define the NEW News Corpus Table for Contextual Grounding ---
@@ -65,6 +88,9 @@ class NewsArticle(Base):
     
     # Location data extracted by NER (Named Entity Recognition)
     location_name = Column(String) # e.g., "Koramangala" or "Whitefield"
+
+    # Primary crime type tagged by the worker's keyword classifier
+    crime_type = Column(String)
     
     # Geolocation features
     latitude = Column(Float)
@@ -74,6 +100,63 @@ class NewsArticle(Base):
     location = Column(Geometry(geometry_type='POINT', srid=4326), index=True)
 
 
+# --- 2c. Precomputed Hotspot Clusters (Materialized View) ---
+# Crimes collapsed onto a ~110 m grid (ST_SnapToGrid, PostGIS-native — the
+# h3 SQL extension isn't installed) per crime type. An order of magnitude
+# smaller than the raw table, so its GiST index is smaller and hotter.
+# Lives here (not main.py) because load_data.py must drop and rebuild it
+# around re-ingest: the view depends on crimes, so the table can't be
+# dropped while it exists.
+MV_HOTSPOTS_DDL = """
+    CREATE MATERIALIZED VIEW IF NOT EXISTS public.mv_hotspots AS
+    SELECT crime_type,
+           COUNT(*) AS incident_count,
+           AVG(latitude) AS latitude,
+           AVG(longitude) AS longitude,
+           ST_Centroid(ST_Collect(location)) AS location
+    FROM public.crimes
+    GROUP BY ST_SnapToGrid(location, 0.001, 0.001), crime_type
+"""
+MV_HOTSPOTS_INDEX_DDL = """
+    CREATE INDEX IF NOT EXISTS ix_mv_hotspots_location
+    ON public.mv_hotspots USING gist (location)
+"""
+
+
+def ensure_hotspot_view():
+    """Creates the mv_hotspots materialized view and its index if missing."""
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(MV_HOTSPOTS_DDL))
+            conn.execute(text(MV_HOTSPOTS_INDEX_DDL))
+        print("✅ mv_hotspots materialized view ready")
+    except Exception as e:
+        print(f"Warning: could not create mv_hotspots: {e}")
+
+
+def drop_hotspot_view():
+    """Drops mv_hotspots (needed before dropping the crimes table)."""
+    try:
+        with engine.begin() as conn:
+            conn.execute(text('DROP MATERIALIZED VIEW IF EXISTS public.mv_hotspots'))
+    except Exception as e:
+        print(f"Warning: could not drop mv_hotspots: {e}")
+
+
+def refresh_hotspot_view():
+    """Rebuilds mv_hotspots from the crimes table (run after data changes).
+
+    Plain REFRESH rather than CONCURRENTLY: the view has no unique index,
+    and the brief lock is fine inside the nightly retrain window.
+    """
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("REFRESH MATERIALIZED VIEW public.mv_hotspots"))
+        print("✅ mv_hotspots refreshed")
+    except Exception as e:
+        print(f"Warning: could not refresh mv_hotspots: {e}")
+
+
 # --- 3. Create the Tables in the Database ---
 def create_tables():
     print("Connecting to d.tabase and creating tables...")